@@ -2,6 +2,16 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from rag_pipeline import ask_groq
 from plant_disease_classifier import PlantDiseaseModel, predict_image
+from weather_proxy import GeocodeCache, LocationNotFoundError, WeatherProxy
+from upstream_guard import (
+    CircuitOpenError,
+    Deadline,
+    DeadlineExceededError,
+    ResponseCache,
+    UpstreamBusyError,
+    UpstreamError,
+    guard_from_env,
+)
 from torchvision import transforms
 import torch
 import json
@@ -14,6 +24,54 @@ import cv2
 app = Flask(__name__)
 CORS(app)
 
+# --- Upstream Guards ---
+# Each external API (LLMs, geocoder, weather) gets its own concurrency cap,
+# timeout and circuit breaker so a slow upstream cannot tie up every worker
+# thread and starve /predict.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 20))
+OPENROUTER_API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+upstream_guards = {
+    "groq": guard_from_env("groq", max_concurrency=4, timeout=15),
+    "openrouter": guard_from_env("openrouter", max_concurrency=4, timeout=20),
+    "nominatim": guard_from_env("nominatim", max_concurrency=1, timeout=5),
+    "agromonitoring": guard_from_env("agromonitoring", max_concurrency=8, timeout=10),
+}
+# Last good answers, served with "degraded": true while an upstream is failing
+chat_cache = ResponseCache()
+recommend_cache = ResponseCache()
+
+# --- Weather/Soil Proxy ---
+# Geocodes are cached on disk, AgroMonitoring responses per lat/lon tile in memory
+weather_proxy = WeatherProxy(
+    api_key=os.environ.get("AGRO_API_KEY"),
+    geocode_cache=GeocodeCache(os.environ.get(
+        "GEOCODE_CACHE_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "geocode_cache.json"),
+    )),
+    geocode_guard=upstream_guards["nominatim"],
+    agro_guard=upstream_guards["agromonitoring"],
+    nominatim_url=os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search"),
+    agro_api_base=os.environ.get("AGRO_API_BASE", "https://api.agromonitoring.com/agro/1.0"),
+    ttl=float(os.environ.get("WEATHER_CACHE_TTL", 600)),
+    tile_degrees=float(os.environ.get("WEATHER_TILE_DEGREES", 0.05)),
+)
+
+
+def upstream_error_response(error, upstream, deadline):
+    """Map a failed guarded upstream call to a JSON error response."""
+    if isinstance(error, CircuitOpenError):
+        retry_after = upstream_guards[error.upstream].breaker.snapshot()["retry_after_seconds"] or 0
+        response = jsonify({"error": f"{upstream} is temporarily unavailable, please retry later"})
+        response.headers["Retry-After"] = str(int(retry_after) + 1)
+        return response, 503
+    if isinstance(error, UpstreamBusyError):
+        response = jsonify({"error": f"{upstream} is busy, please retry shortly"})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    if isinstance(error, DeadlineExceededError) or deadline.expired():
+        return jsonify({"error": f"{upstream} did not respond in time"}), 504
+    return jsonify({"error": f"{upstream} request failed: {error}"}), 502
+
 # --- Load Plant Disease Model ---
 # Load config with fallback values
 config_path = "models/model_config.json" if os.path.exists("models/model_config.json") else "model_config.json"
@@ -196,7 +254,17 @@ def chat():
     if not query:
         return jsonify({"error": "No query provided"}), 400
 
-    reply = ask_groq(query)
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    cache_key = " ".join(query.lower().split())
+    try:
+        reply = upstream_guards["groq"].call(ask_groq, query, deadline=deadline)
+    except Exception as e:
+        cached = chat_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({"reply": cached, "degraded": True})
+        return upstream_error_response(e, "groq", deadline)
+
+    chat_cache.set(cache_key, reply)
     return jsonify({"reply": reply})
 
 # --- Plant Disease Prediction Endpoint ---
@@ -243,8 +311,16 @@ def predict():
         return jsonify({"error": str(e)}), 500
 
 # --- Indoor Plant Recommendations Endpoint ---
+def call_openrouter(headers, payload, timeout):
+    """POST to OpenRouter, raising on non-200 so the circuit breaker counts it as a failure."""
+    response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"OpenRouter returned HTTP {response.status_code}")
+    return response.json()
+
 @app.route("/indoor-plants/recommend", methods=["POST"])
 def indoor_plants_recommend():
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
     try:
         data = request.get_json()
         
@@ -253,6 +329,7 @@ def indoor_plants_recommend():
         light_condition = data.get("light_condition", "")
         experience_level = data.get("experience_level", "")
         space_available = data.get("space_available", "")
+        cache_key = tuple(str(v).strip().lower() for v in (plant_type, light_condition, experience_level, space_available))
         
         # Get your OpenRouter API key from environment variable
         openrouter_api_key = os.environ.get("OPENROUTER_API_KEY")
@@ -309,22 +386,21 @@ def indoor_plants_recommend():
             "max_tokens": 1000
         }
         
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to get recommendations from AI service"}), 500
+        try:
+            result = upstream_guards["openrouter"].call(call_openrouter, headers, payload, deadline=deadline)
+        except Exception as e:
+            cached = recommend_cache.get(cache_key)
+            if cached is not None:
+                return jsonify({**cached, "degraded": True})
+            return upstream_error_response(e, "openrouter", deadline)
         
-        result = response.json()
         content = result['choices'][0]['message']['content']
         
         # Parse the JSON response
         try:
             recommendations = json.loads(content)
+            if isinstance(recommendations, dict):
+                recommend_cache.set(cache_key, recommendations)
             return jsonify(recommendations)
         except json.JSONDecodeError:
             return jsonify({
@@ -342,8 +418,39 @@ def indoor_plants_recommend():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# --- Weather/Soil Proxy Endpoint ---
+@app.route("/weather", methods=["GET"])
+def weather_report():
+    state = request.args.get("state", "").strip()
+    district = request.args.get("district", "").strip()
+    if not state or not district:
+        return jsonify({"error": "Both state and district are required"}), 400
+    if not weather_proxy.api_key:
+        return jsonify({"error": "AgroMonitoring API key not configured"}), 500
+
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    try:
+        return jsonify(weather_proxy.report(state, district, deadline=deadline))
+    except LocationNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except UpstreamError as e:
+        return upstream_error_response(e, e.upstream, deadline)
+    except Exception as e:
+        # Keep upstream details out of the response, they may include request URLs
+        print(f"Weather report for {district}, {state} failed: {e!r}")
+        if deadline.expired():
+            return jsonify({"error": "weather service did not respond in time"}), 504
+        return jsonify({"error": "weather service request failed"}), 502
+
+# --- Upstream Status Endpoint ---
+@app.route("/upstreams", methods=["GET"])
+def upstreams_status():
+    status = {name: guard.snapshot() for name, guard in upstream_guards.items()}
+    status["weather_proxy"] = weather_proxy.snapshot()
+    return jsonify(status)
+
 # --- Home Route ---
 @app.route("/", methods=["GET"])
 def home():
-    return "🌱 Welcome to CropCure Backend! Use /chat for chatbot, /predict for plant disease detection, and /indoor-plants/recommend for indoor plant advice."
+    return "🌱 Welcome to CropCure Backend! Use /chat for chatbot, /predict for plant disease detection, /indoor-plants/recommend for indoor plant advice, /weather for weather and soil data, and /upstreams for external API and weather cache health."
 
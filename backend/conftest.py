@@ -0,0 +1,13 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Backend modules and the test helpers are imported as top-level modules,
+# whichever directory pytest is started from.
+for path in (BASE_DIR, os.path.join(BASE_DIR, "tests")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Manual scripts that need a running server or a MySQL database, not pytest tests
+collect_ignore = ["test_dp.py", os.path.join("tests", "test_api.py")]
@@ -51,7 +51,8 @@ def retrieve_context(query, top_k=2):
     distances, indices = index.search(query_embedding, top_k)
     return [corpus[i] for i in indices[0]]
 
-def ask_groq(query):
+def ask_groq(query, timeout=None):
+    """Answer `query` from the knowledge base. `timeout` bounds the Groq call (no SDK retries)."""
     context = retrieve_context(query)
     prompt = f"""
     You are an agriculture assistant. Answer based only on this context:
@@ -60,7 +61,11 @@ def ask_groq(query):
     Question: {query}
     """
 
-    completion = client.chat.completions.create(
+    groq_client = client
+    if timeout is not None:
+        groq_client = client.with_options(timeout=timeout, max_retries=0)
+
+    completion = groq_client.chat.completions.create(
         model="llama-3.3-70b-versatile",  # or llama-3.1-8b-instant
         messages=[{"role": "user", "content": prompt}],
     )
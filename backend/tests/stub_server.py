@@ -0,0 +1,57 @@
+"""Local fault-injecting HTTP stub used in place of real upstream APIs."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class StubServer:
+    """
+    Serves canned JSON responses on 127.0.0.1 with injectable faults.
+
+    Set `routes[path] = {"status": 200, "body": {...}, "delay": 0.0}` to
+    control what a path returns; `hits[path]` counts requests per path.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self):
+                path = urlparse(self.path).path
+                with stub._lock:
+                    stub.hits[path] = stub.hits.get(path, 0) + 1
+                    route = stub.routes.get(path, {"status": 404, "body": {"error": "not found"}})
+                time.sleep(route.get("delay", 0.0))
+                body = json.dumps(route.get("body", {})).encode()
+                try:
+                    self.send_response(route.get("status", 200))
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
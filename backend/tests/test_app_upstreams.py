@@ -0,0 +1,223 @@
+import json
+import socket
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+# The real rag_pipeline needs a Groq API key and downloads an embedding model
+# at import time; these tests replace ask_groq on the app module anyway.
+if "rag_pipeline" not in sys.modules:
+    rag_pipeline = types.ModuleType("rag_pipeline")
+    rag_pipeline.ask_groq = None
+    sys.modules["rag_pipeline"] = rag_pipeline
+
+import app as backend_app  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+from upstream_guard import CircuitBreaker, ResponseCache, UpstreamGuard  # noqa: E402
+from weather_proxy import GeocodeCache, WeatherProxy  # noqa: E402
+
+RECOMMEND_PARAMS = {
+    "plant_type": "Herbs",
+    "light_condition": "Low",
+    "experience_level": "Beginner",
+    "space_available": "Small",
+}
+
+
+def make_guard(name):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=30)
+    return UpstreamGuard(name, max_concurrency=1, timeout=1.0, queue_timeout=0.05, breaker=breaker)
+
+
+def openrouter_body(recommendations):
+    return {"choices": [{"message": {"content": json.dumps({"recommendations": recommendations})}}]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(backend_app, "chat_cache", ResponseCache())
+    monkeypatch.setattr(backend_app, "recommend_cache", ResponseCache())
+    monkeypatch.setitem(backend_app.upstream_guards, "groq", make_guard("groq"))
+    monkeypatch.setitem(backend_app.upstream_guards, "openrouter", make_guard("openrouter"))
+    return backend_app.app.test_client()
+
+
+@pytest.fixture
+def openrouter(monkeypatch):
+    with StubServer() as server:
+        server.routes["/api/v1/chat/completions"] = {"body": openrouter_body([{"technique": "Hydroponics"}])}
+        monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+        monkeypatch.setattr(backend_app, "OPENROUTER_API_URL", server.url + "/api/v1/chat/completions")
+        yield server
+
+
+@pytest.fixture
+def weather_upstreams(monkeypatch, tmp_path):
+    with StubServer() as server:
+        server.routes["/search"] = {"body": [{"lat": "18.5204", "lon": "73.8567"}]}
+        for kind in ("weather", "soil", "forecast"):
+            server.routes[f"/agro/{kind}"] = {"body": {"kind": kind}}
+        proxy = WeatherProxy(
+            api_key="test-key",
+            geocode_cache=GeocodeCache(str(tmp_path / "geocode_cache.json")),
+            geocode_guard=make_guard("nominatim"),
+            agro_guard=UpstreamGuard("agromonitoring", timeout=1.0),
+            nominatim_url=server.url + "/search",
+            agro_api_base=server.url + "/agro",
+        )
+        monkeypatch.setattr(backend_app, "weather_proxy", proxy)
+        yield server
+
+
+def test_chat_serves_cached_reply_when_groq_fails(client, monkeypatch):
+    monkeypatch.setattr(backend_app, "ask_groq", lambda query, timeout: f"answer to {query}")
+    response = client.post("/chat", json={"query": "Yellow spots on tomato"})
+    assert response.status_code == 200
+    assert response.get_json() == {"reply": "answer to Yellow spots on tomato"}
+
+    def failing(query, timeout):
+        raise RuntimeError("groq is down")
+
+    monkeypatch.setattr(backend_app, "ask_groq", failing)
+    response = client.post("/chat", json={"query": "  yellow SPOTS on tomato "})
+    assert response.status_code == 200
+    assert response.get_json() == {"reply": "answer to Yellow spots on tomato", "degraded": True}
+
+
+def test_chat_fails_fast_with_retry_after_when_circuit_open(client, monkeypatch):
+    calls = []
+
+    def failing(query, timeout):
+        calls.append(query)
+        raise RuntimeError("groq is down")
+
+    monkeypatch.setattr(backend_app, "ask_groq", failing)
+    assert client.post("/chat", json={"query": "first"}).status_code == 502
+
+    response = client.post("/chat", json={"query": "second"})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert calls == ["first"]
+
+
+def test_chat_returns_503_when_groq_is_busy(client, monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking(query, timeout):
+        started.set()
+        release.wait(timeout)
+        return "late answer"
+
+    monkeypatch.setattr(backend_app, "ask_groq", blocking)
+    worker = threading.Thread(
+        target=lambda: backend_app.app.test_client().post("/chat", json={"query": "first"})
+    )
+    worker.start()
+    try:
+        assert started.wait(1)
+        start = time.monotonic()
+        response = client.post("/chat", json={"query": "second"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert time.monotonic() - start < 0.5
+    finally:
+        release.set()
+        worker.join()
+
+
+def test_chat_returns_504_when_deadline_passes(client, monkeypatch):
+    def slow(query, timeout):
+        time.sleep(timeout)
+        raise TimeoutError("groq timed out")
+
+    monkeypatch.setattr(backend_app, "REQUEST_DEADLINE_SECONDS", 0.2)
+    monkeypatch.setattr(backend_app, "ask_groq", slow)
+    response = client.post("/chat", json={"query": "slow question"})
+    assert response.status_code == 504
+
+
+def test_recommend_degrades_then_fails_fast(client, openrouter):
+    response = client.post("/indoor-plants/recommend", json=RECOMMEND_PARAMS)
+    assert response.status_code == 200
+    assert response.get_json() == {"recommendations": [{"technique": "Hydroponics"}]}
+
+    openrouter.routes["/api/v1/chat/completions"] = {"status": 500, "body": {"error": "boom"}}
+    response = client.post("/indoor-plants/recommend", json=RECOMMEND_PARAMS)
+    assert response.status_code == 200
+    assert response.get_json() == {"recommendations": [{"technique": "Hydroponics"}], "degraded": True}
+
+    response = client.post("/indoor-plants/recommend", json={**RECOMMEND_PARAMS, "plant_type": "Cacti"})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert openrouter.hits["/api/v1/chat/completions"] == 2
+
+
+def test_recommend_returns_504_when_openrouter_is_slow(client, openrouter, monkeypatch):
+    openrouter.routes["/api/v1/chat/completions"]["delay"] = 0.5
+    monkeypatch.setattr(backend_app, "REQUEST_DEADLINE_SECONDS", 0.2)
+    response = client.post("/indoor-plants/recommend", json=RECOMMEND_PARAMS)
+    assert response.status_code == 504
+
+
+def test_upstreams_reports_guard_state(client, monkeypatch):
+    def failing(query, timeout):
+        raise RuntimeError("groq is down")
+
+    monkeypatch.setattr(backend_app, "ask_groq", failing)
+    client.post("/chat", json={"query": "anything"})
+
+    response = client.get("/upstreams")
+    assert response.status_code == 200
+    status = response.get_json()
+    assert {"groq", "openrouter", "nominatim", "agromonitoring"} <= set(status)
+    assert status["groq"]["breaker"]["state"] == "open"
+    assert status["groq"]["metrics"]["failures"] == 1
+    assert status["openrouter"]["breaker"]["state"] == "closed"
+
+
+def test_weather_returns_report(client, weather_upstreams):
+    response = client.get("/weather", query_string={"state": "Maharashtra", "district": "Pune"})
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report["soil"] == {"kind": "soil"}
+    assert report["location"]["district"] == "Pune"
+
+
+def test_weather_unknown_location_is_404(client, weather_upstreams):
+    weather_upstreams.routes["/search"] = {"body": []}
+    response = client.get("/weather", query_string={"state": "Nowhere", "district": "Nothing"})
+    assert response.status_code == 404
+
+
+def test_weather_malformed_geocode_is_502(client, weather_upstreams):
+    weather_upstreams.routes["/search"] = {"body": [{"lon": "73.8567"}]}
+    response = client.get("/weather", query_string={"state": "Maharashtra", "district": "Pune"})
+    assert response.status_code == 502
+
+
+def assert_key_not_leaked(response):
+    body = response.get_data(as_text=True)
+    assert "appid" not in body
+    assert "test-key" not in body
+
+
+def test_weather_agromonitoring_401_does_not_leak_key(client, weather_upstreams):
+    weather_upstreams.routes["/agro/weather"] = {"status": 401, "body": {"message": "Invalid API key"}}
+    response = client.get("/weather", query_string={"state": "Maharashtra", "district": "Pune"})
+    assert response.status_code == 502
+    assert_key_not_leaked(response)
+
+
+def test_weather_refused_connection_does_not_leak_key(client, weather_upstreams):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed_port = sock.getsockname()[1]
+    backend_app.weather_proxy.agro_api_base = f"http://127.0.0.1:{closed_port}/agro"
+
+    response = client.get("/weather", query_string={"state": "Maharashtra", "district": "Pune"})
+    assert response.status_code == 502
+    assert_key_not_leaked(response)
@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from stub_server import StubServer
+from upstream_guard import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    Deadline,
+    DeadlineExceededError,
+    ResponseCache,
+    UpstreamBusyError,
+    UpstreamGuard,
+)
+
+
+def fetch(url, timeout):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        server.routes["/chat"] = {"status": 200, "body": {"reply": "ok"}}
+        yield server
+
+
+def make_guard(**breaker_kwargs):
+    breaker_options = dict(window_size=4, min_calls=2, open_seconds=0.3, slow_call_seconds=5.0)
+    breaker_options.update(breaker_kwargs)
+    return UpstreamGuard("stub", max_concurrency=2, timeout=1.0, breaker=CircuitBreaker(**breaker_options))
+
+
+def test_successful_call_records_metrics(stub):
+    guard = make_guard()
+    assert guard.call(fetch, stub.url + "/chat") == {"reply": "ok"}
+
+    snapshot = guard.snapshot()
+    assert snapshot["metrics"]["successes"] == 1
+    assert snapshot["in_flight"] == 0
+    assert snapshot["breaker"]["state"] == CLOSED
+
+
+def test_server_errors_open_circuit_and_fail_fast(stub):
+    stub.routes["/chat"] = {"status": 500, "body": {"error": "boom"}}
+    guard = make_guard()
+
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError):
+            guard.call(fetch, stub.url + "/chat")
+    assert guard.breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        guard.call(fetch, stub.url + "/chat")
+    assert stub.hits["/chat"] == 2
+    assert guard.snapshot()["metrics"]["rejected_open"] == 1
+
+
+def test_slow_upstream_times_out_and_opens_circuit(stub):
+    stub.routes["/chat"] = {"status": 200, "body": {"reply": "late"}, "delay": 0.5}
+    guard = UpstreamGuard("stub", timeout=0.1, breaker=CircuitBreaker(min_calls=2, open_seconds=5))
+
+    for _ in range(2):
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            guard.call(fetch, stub.url + "/chat")
+        assert time.monotonic() - start < 0.4
+    assert guard.breaker.state == OPEN
+
+
+def test_slow_successes_open_circuit(stub):
+    stub.routes["/chat"] = {"status": 200, "body": {"reply": "slow"}, "delay": 0.1}
+    guard = make_guard(slow_call_seconds=0.05)
+
+    guard.call(fetch, stub.url + "/chat")
+    guard.call(fetch, stub.url + "/chat")
+    assert guard.breaker.state == OPEN
+
+
+def test_half_open_probe_closes_circuit_after_recovery(stub):
+    stub.routes["/chat"] = {"status": 503, "body": {}}
+    guard = make_guard()
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError):
+            guard.call(fetch, stub.url + "/chat")
+    assert guard.breaker.state == OPEN
+
+    stub.routes["/chat"] = {"status": 200, "body": {"reply": "back"}}
+    time.sleep(0.35)
+    assert guard.breaker.state == HALF_OPEN
+    assert guard.call(fetch, stub.url + "/chat") == {"reply": "back"}
+    assert guard.breaker.state == CLOSED
+
+
+def test_failed_half_open_probe_reopens_circuit(stub):
+    stub.routes["/chat"] = {"status": 500, "body": {}}
+    guard = make_guard()
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError):
+            guard.call(fetch, stub.url + "/chat")
+
+    time.sleep(0.35)
+    with pytest.raises(urllib.error.HTTPError):
+        guard.call(fetch, stub.url + "/chat")
+    assert guard.breaker.state == OPEN
+    assert guard.breaker.times_opened == 2
+
+
+def test_stale_calls_do_not_act_as_half_open_probes():
+    now = [0.0]
+    breaker = CircuitBreaker(min_calls=2, open_seconds=10, clock=lambda: now[0])
+    stale = breaker.allow_request()
+    for _ in range(2):
+        breaker.record(breaker.allow_request(), False, 0.1)
+    assert breaker.state == OPEN
+
+    now[0] = 10
+    assert breaker.state == HALF_OPEN
+    breaker.record(stale, True, 0.1)  # admitted while closed, finishes late
+    assert breaker.state == HALF_OPEN
+
+    probe = breaker.allow_request()
+    assert probe is not None
+    assert breaker.allow_request() is None  # only one probe at a time
+    breaker.record(stale, False, 0.1)
+    assert breaker.allow_request() is None
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_concurrency_cap_rejects_when_slots_stay_busy(stub):
+    stub.routes["/chat"] = {"status": 200, "body": {"reply": "slow"}, "delay": 0.5}
+    guard = UpstreamGuard("stub", max_concurrency=1, timeout=2.0)
+
+    worker = threading.Thread(target=guard.call, args=(fetch, stub.url + "/chat"))
+    worker.start()
+    time.sleep(0.1)
+    try:
+        with pytest.raises(UpstreamBusyError):
+            guard.call(fetch, stub.url + "/chat", deadline=Deadline(0.1))
+        assert guard.snapshot()["in_flight"] == 1
+    finally:
+        worker.join()
+    assert stub.hits["/chat"] == 1
+    assert guard.breaker.state == CLOSED
+
+
+def test_busy_guard_rejects_well_before_deadline(stub):
+    stub.routes["/chat"] = {"status": 200, "body": {"reply": "slow"}, "delay": 1.0}
+    guard = UpstreamGuard("stub", max_concurrency=1, timeout=2.0, queue_timeout=0.1)
+
+    worker = threading.Thread(target=guard.call, args=(fetch, stub.url + "/chat"))
+    worker.start()
+    time.sleep(0.1)
+    try:
+        start = time.monotonic()
+        with pytest.raises(UpstreamBusyError):
+            guard.call(fetch, stub.url + "/chat", deadline=Deadline(5.0))
+        assert time.monotonic() - start < 0.5
+        assert guard.snapshot()["metrics"]["rejected_busy"] == 1
+    finally:
+        worker.join()
+
+
+def test_expired_deadline_skips_upstream(stub):
+    guard = make_guard()
+    with pytest.raises(DeadlineExceededError):
+        guard.call(fetch, stub.url + "/chat", deadline=Deadline(0))
+    assert "/chat" not in stub.hits
+
+
+def test_response_cache_expires_and_evicts():
+    now = [0.0]
+    cache = ResponseCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    now[0] = 11
+    assert cache.get("c") is None
@@ -0,0 +1,226 @@
+import threading
+import time
+
+import pytest
+
+from stub_server import StubServer
+from upstream_guard import Deadline, DeadlineExceededError, UpstreamBusyError
+from weather_proxy import (
+    GeocodeCache,
+    LocationNotFoundError,
+    UpstreamHTTPError,
+    WeatherProxy,
+    normalize_location,
+    tile_key,
+)
+
+
+@pytest.fixture
+def stub():
+    with StubServer() as server:
+        server.routes["/search"] = {"body": [{"lat": "18.5204", "lon": "73.8567"}]}
+        server.routes["/agro/weather"] = {"body": {"main": {"temp": 300.1}}}
+        server.routes["/agro/soil"] = {"body": {"moisture": 0.2}}
+        server.routes["/agro/forecast"] = {"body": [{"temp": {"min": 290, "max": 300}}]}
+        yield server
+
+
+def make_proxy(stub, tmp_path, **kwargs):
+    return WeatherProxy(
+        api_key="test-key",
+        geocode_cache=GeocodeCache(str(tmp_path / "geocode_cache.json")),
+        nominatim_url=stub.url + "/search",
+        agro_api_base=stub.url + "/agro",
+        **kwargs,
+    )
+
+
+def test_report_fetches_all_kinds(stub, tmp_path):
+    report = make_proxy(stub, tmp_path).report("Maharashtra", "Pune")
+
+    assert report["weather"] == {"main": {"temp": 300.1}}
+    assert report["soil"] == {"moisture": 0.2}
+    assert report["forecast"] == [{"temp": {"min": 290, "max": 300}}]
+    assert report["location"]["lat"] == pytest.approx(18.5204)
+
+
+def test_geocode_cache_is_normalized_and_persistent(stub, tmp_path):
+    make_proxy(stub, tmp_path).geocode("Maharashtra", "Pune")
+
+    restarted = make_proxy(stub, tmp_path)
+    assert restarted.geocode("  maharashtra ", "PUNE") == {"lat": 18.5204, "lon": 73.8567}
+    assert stub.hits["/search"] == 1
+    assert normalize_location("Uttar  Pradesh", " Agra") == "agra, uttar pradesh"
+
+
+def test_geocode_cache_merges_writes_from_other_processes(tmp_path):
+    path = str(tmp_path / "geocode_cache.json")
+    first, second = GeocodeCache(path), GeocodeCache(path)
+
+    first.set("pune, maharashtra", {"lat": 18.5, "lon": 73.9})
+    second.set("agra, uttar pradesh", {"lat": 27.2, "lon": 78.0})
+
+    assert second.get("pune, maharashtra") == {"lat": 18.5, "lon": 73.9}
+    assert len(GeocodeCache(path)) == 2
+    assert [p.name for p in tmp_path.iterdir()] == ["geocode_cache.json"]
+
+
+def test_nearby_coordinates_share_a_tile(stub, tmp_path):
+    proxy = make_proxy(stub, tmp_path, tile_degrees=0.05)
+    assert tile_key(18.52, 73.85, 0.05) == tile_key(18.51, 73.86, 0.05)
+
+    proxy.fetch("weather", 18.52, 73.85)
+    proxy.fetch("weather", 18.51, 73.86)
+    assert stub.hits["/agro/weather"] == 1
+    assert proxy.snapshot()["metrics"]["response_hits"] == 1
+
+
+def test_cached_responses_expire(stub, tmp_path):
+    proxy = make_proxy(stub, tmp_path, ttl=0.1)
+    proxy.fetch("soil", 18.52, 73.85)
+    time.sleep(0.15)
+    proxy.fetch("soil", 18.52, 73.85)
+    assert stub.hits["/agro/soil"] == 2
+
+
+def test_concurrent_reports_are_coalesced(stub, tmp_path):
+    stub.routes["/search"]["delay"] = 0.2
+    for kind in ("weather", "soil", "forecast"):
+        stub.routes[f"/agro/{kind}"]["delay"] = 0.2
+    proxy = make_proxy(stub, tmp_path)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(proxy.report("Maharashtra", "Pune")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5
+    assert stub.hits == {"/search": 1, "/agro/weather": 1, "/agro/soil": 1, "/agro/forecast": 1}
+
+
+def test_coalesced_follower_keeps_its_own_deadline(stub, tmp_path):
+    stub.routes["/agro/weather"]["delay"] = 0.5
+    proxy = make_proxy(stub, tmp_path)
+    leader = threading.Thread(target=proxy.fetch, args=("weather", 18.52, 73.85, Deadline(5)))
+    leader.start()
+    time.sleep(0.1)
+    try:
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceededError):
+            proxy.fetch("weather", 18.52, 73.85, deadline=Deadline(0.1))
+        assert time.monotonic() - start < 0.3
+    finally:
+        leader.join()
+    assert stub.hits["/agro/weather"] == 1
+
+
+def test_follower_retries_when_leader_runs_out_of_time(stub, tmp_path):
+    stub.routes["/agro/weather"]["delay"] = 0.3
+    proxy = make_proxy(stub, tmp_path)
+    errors = []
+
+    def short_leader():
+        try:
+            proxy.fetch("weather", 18.52, 73.85, deadline=Deadline(0.1))
+        except Exception as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=short_leader)
+    leader.start()
+    time.sleep(0.05)
+    assert proxy.fetch("weather", 18.52, 73.85, deadline=Deadline(5)) == {"main": {"temp": 300.1}}
+    leader.join()
+    assert len(errors) == 1
+    assert stub.hits["/agro/weather"] == 2
+
+
+def test_report_fans_out_in_parallel(stub, tmp_path):
+    for kind in ("weather", "soil", "forecast"):
+        stub.routes[f"/agro/{kind}"]["delay"] = 0.3
+    proxy = make_proxy(stub, tmp_path)
+    proxy.geocode("Maharashtra", "Pune")
+
+    start = time.monotonic()
+    proxy.report("Maharashtra", "Pune")
+    assert time.monotonic() - start < 0.6
+
+
+def test_report_raises_first_failure_without_waiting_for_slow_kinds(stub, tmp_path):
+    stub.routes["/agro/weather"]["delay"] = 1.0
+    stub.routes["/agro/soil"] = {"status": 500, "body": {}}
+    proxy = make_proxy(stub, tmp_path)
+    proxy.geocode("Maharashtra", "Pune")
+
+    start = time.monotonic()
+    with pytest.raises(UpstreamHTTPError):
+        proxy.report("Maharashtra", "Pune", deadline=Deadline(5))
+    assert time.monotonic() - start < 0.5
+
+
+def test_saturated_pool_rejects_quickly_and_skips_other_kinds(stub, tmp_path):
+    stub.routes["/agro/weather"]["delay"] = 1.0
+    proxy = make_proxy(stub, tmp_path, max_workers=1)
+    proxy.geocode("Maharashtra", "Pune")
+
+    start = time.monotonic()
+    with pytest.raises(UpstreamBusyError):
+        proxy.report("Maharashtra", "Pune", deadline=Deadline(5))
+    assert time.monotonic() - start < 0.6
+    time.sleep(1.0)
+    assert "/agro/soil" not in stub.hits
+    assert "/agro/forecast" not in stub.hits
+
+
+def test_cache_hits_do_not_need_a_pool_worker(stub, tmp_path):
+    proxy = make_proxy(stub, tmp_path, max_workers=1)
+    proxy.report("Maharashtra", "Pune")
+    proxy.geocode_cache.set("nashik, maharashtra", {"lat": 20.0, "lon": 73.8})
+    stub.routes["/agro/weather"]["delay"] = 1.0
+
+    busy = threading.Thread(target=proxy.report, args=("Maharashtra", "Nashik"), kwargs={"kinds": ("weather",)})
+    busy.start()
+    time.sleep(0.1)
+    try:
+        start = time.monotonic()
+        report = proxy.report("Maharashtra", "Pune", deadline=Deadline(5))
+        assert time.monotonic() - start < 0.1
+        assert report["soil"] == {"moisture": 0.2}
+    finally:
+        busy.join()
+
+
+def test_report_without_deadline_uses_report_timeout(stub, tmp_path):
+    stub.routes["/agro/forecast"]["delay"] = 1.0
+    proxy = make_proxy(stub, tmp_path, report_timeout=0.3)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        proxy.report("Maharashtra", "Pune")
+    assert time.monotonic() - start < 0.6
+
+
+def test_unknown_location_raises_location_not_found(stub, tmp_path):
+    stub.routes["/search"] = {"body": []}
+    with pytest.raises(LocationNotFoundError):
+        make_proxy(stub, tmp_path).report("Nowhere", "Nothing")
+    assert len(make_proxy(stub, tmp_path).geocode_cache) == 0
+
+
+def test_unknown_location_is_cached_briefly(stub, tmp_path):
+    stub.routes["/search"] = {"body": []}
+    proxy = make_proxy(stub, tmp_path, ttl=0.2)
+    for _ in range(3):
+        with pytest.raises(LocationNotFoundError):
+            proxy.geocode("Maharashtra", "Pnue")
+    assert stub.hits["/search"] == 1
+    assert proxy.snapshot()["metrics"]["geocode_not_found_hits"] == 2
+
+    time.sleep(0.25)
+    with pytest.raises(LocationNotFoundError):
+        proxy.geocode("Maharashtra", "Pnue")
+    assert stub.hits["/search"] == 2
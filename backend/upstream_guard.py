@@ -0,0 +1,346 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+# --- Errors raised instead of calling the upstream ---
+class UpstreamError(Exception):
+    """Base class for calls rejected or abandoned by an UpstreamGuard."""
+
+    def __init__(self, upstream, message):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+
+
+class CircuitOpenError(UpstreamError):
+    """The circuit breaker is open, the upstream is not being called."""
+
+
+class UpstreamBusyError(UpstreamError):
+    """Every concurrency slot for the upstream stayed taken for the whole queue timeout."""
+
+
+class DeadlineExceededError(UpstreamError):
+    """The request ran out of time before (or while) calling the upstream."""
+
+
+# --- Request deadline ---
+class Deadline:
+    """End-to-end time budget for a single request."""
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self.clock())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+# --- Circuit breaker ---
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker.
+
+    Trips to OPEN when, over the last `window_size` calls (and at least
+    `min_calls` of them), the failure rate or the slow-call rate reaches its
+    threshold. After `open_seconds` it lets `half_open_max_calls` probes
+    through; one failed probe re-opens it, all probes succeeding closes it.
+
+    allow_request() hands out a permit tagged with the breaker's generation,
+    which changes on every state transition. Outcomes recorded with a permit
+    from an earlier generation (a call that finished after the breaker moved
+    on) are discarded, so only real probes decide the half-open state.
+    """
+
+    def __init__(self, window_size=20, min_calls=5, failure_rate_threshold=0.5,
+                 slow_call_seconds=10.0, slow_call_rate_threshold=0.5,
+                 open_seconds=30.0, half_open_max_calls=1, clock=time.monotonic):
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._generation = 0
+        self._window = deque(maxlen=window_size)  # (failed, slow) per call
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._generation += 1
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self._generation += 1
+        self._window.clear()
+        self.times_opened += 1
+
+    def allow_request(self):
+        """
+        Return a permit `(generation, is_probe)` if a call may go through
+        (reserving a probe slot when half-open), or None to reject it.
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return (self._generation, False)
+            if self._state == HALF_OPEN and self._half_open_in_flight < self.half_open_max_calls:
+                self._half_open_in_flight += 1
+                return (self._generation, True)
+            return None
+
+    def record(self, permit, success, duration):
+        """Record the outcome of a call admitted with `permit`."""
+        generation, is_probe = permit
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if generation != self._generation:
+                # Admitted before the last state transition, it no longer says anything.
+                return
+            if is_probe:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+                if not success or slow:
+                    self._trip()
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.half_open_max_calls:
+                    self._state = CLOSED
+                    self._generation += 1
+                    self._window.clear()
+                return
+
+            self._window.append((not success, slow))
+            calls = len(self._window)
+            if calls < self.min_calls:
+                return
+            failure_rate = sum(1 for failed, _ in self._window if failed) / calls
+            slow_rate = sum(1 for _, is_slow in self._window if is_slow) / calls
+            if (failure_rate >= self.failure_rate_threshold
+                    or slow_rate >= self.slow_call_rate_threshold):
+                self._trip()
+
+    def cancel(self, permit):
+        """Give back `permit` when the upstream was never called."""
+        generation, is_probe = permit
+        with self._lock:
+            if is_probe and generation == self._generation:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def snapshot(self):
+        with self._lock:
+            self._maybe_half_open()
+            calls = len(self._window)
+            failures = sum(1 for failed, _ in self._window if failed)
+            slow = sum(1 for _, is_slow in self._window if is_slow)
+            retry_after = None
+            if self._state == OPEN:
+                retry_after = max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+            return {
+                "state": self._state,
+                "window_calls": calls,
+                "failure_rate": failures / calls if calls else 0.0,
+                "slow_call_rate": slow / calls if calls else 0.0,
+                "times_opened": self.times_opened,
+                "retry_after_seconds": retry_after,
+            }
+
+
+# --- Per-upstream guard ---
+class UpstreamGuard:
+    """
+    Concurrency cap + deadline + circuit breaker around calls to one upstream.
+
+    `fn` passed to call() receives a `timeout` keyword argument holding the
+    seconds left for the call, so it can hand it to its HTTP client. When all
+    slots are taken a caller waits at most `queue_timeout` seconds for one
+    before being turned away, so it doesn't hold its worker thread meanwhile.
+    """
+
+    def __init__(self, name, max_concurrency=4, timeout=15.0, queue_timeout=0.25,
+                 breaker=None, clock=time.monotonic):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.clock = clock
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._metrics = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "rejected_open": 0,
+            "rejected_busy": 0,
+            "deadline_exceeded": 0,
+        }
+        self._latencies = deque(maxlen=100)
+
+    def _count(self, key):
+        with self._lock:
+            self._metrics[key] += 1
+
+    def call(self, fn, *args, deadline=None, **kwargs):
+        if deadline is None:
+            deadline = Deadline(self.timeout, clock=self.clock)
+
+        permit = self.breaker.allow_request()
+        if permit is None:
+            self._count("rejected_open")
+            raise CircuitOpenError(self.name, "circuit open, failing fast")
+
+        if deadline.expired():
+            self._count("deadline_exceeded")
+            self.breaker.cancel(permit)
+            raise DeadlineExceededError(self.name, "request deadline already passed")
+
+        if not self._slots.acquire(timeout=min(self.queue_timeout, deadline.remaining())):
+            self._count("rejected_busy")
+            self.breaker.cancel(permit)
+            raise UpstreamBusyError(self.name, f"all {self.max_concurrency} slots busy")
+
+        with self._lock:
+            self._in_flight += 1
+            self._metrics["calls"] += 1
+        start = self.clock()
+        try:
+            timeout = min(self.timeout, deadline.remaining())
+            if timeout <= 0:
+                self._count("deadline_exceeded")
+                self.breaker.cancel(permit)
+                raise DeadlineExceededError(self.name, "no time left to call upstream")
+            try:
+                result = fn(*args, timeout=timeout, **kwargs)
+            except Exception:
+                duration = self.clock() - start
+                self.breaker.record(permit, False, duration)
+                self._record_latency(duration, "failures")
+                if deadline.expired():
+                    self._count("deadline_exceeded")
+                raise
+            duration = self.clock() - start
+            self.breaker.record(permit, True, duration)
+            self._record_latency(duration, "successes")
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def _record_latency(self, duration, outcome):
+        with self._lock:
+            self._metrics[outcome] += 1
+            self._latencies.append(duration)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            metrics = dict(self._metrics)
+            in_flight = self._in_flight
+        p50 = latencies[len(latencies) // 2] if latencies else None
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+        return {
+            "name": self.name,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": in_flight,
+            "timeout_seconds": self.timeout,
+            "queue_timeout_seconds": self.queue_timeout,
+            "latency_p50_seconds": p50,
+            "latency_p95_seconds": p95,
+            "metrics": metrics,
+            "breaker": self.breaker.snapshot(),
+        }
+
+
+# --- Degraded-mode cache of last good answers ---
+class ResponseCache:
+    """Small thread-safe TTL + LRU cache for serving stale answers when an upstream is down."""
+
+    def __init__(self, max_entries=256, ttl=3600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.clock() - stored_at > self.ttl:
+                return None
+            self._entries[key] = entry  # re-insert as most recently used
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.clock(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def guard_from_env(name, max_concurrency, timeout):
+    """
+    Build an UpstreamGuard whose limits can be overridden with env vars,
+    e.g. GROQ_MAX_CONCURRENCY, GROQ_TIMEOUT, GROQ_QUEUE_TIMEOUT,
+    GROQ_BREAKER_OPEN_SECONDS.
+    """
+    prefix = name.upper()
+    breaker = CircuitBreaker(
+        window_size=int(_env_float(f"{prefix}_BREAKER_WINDOW", 20)),
+        min_calls=int(_env_float(f"{prefix}_BREAKER_MIN_CALLS", 5)),
+        failure_rate_threshold=_env_float(f"{prefix}_BREAKER_FAILURE_RATE", 0.5),
+        slow_call_seconds=_env_float(f"{prefix}_BREAKER_SLOW_SECONDS", timeout * 0.8),
+        slow_call_rate_threshold=_env_float(f"{prefix}_BREAKER_SLOW_RATE", 0.5),
+        open_seconds=_env_float(f"{prefix}_BREAKER_OPEN_SECONDS", 30),
+    )
+    return UpstreamGuard(
+        name,
+        max_concurrency=int(_env_float(f"{prefix}_MAX_CONCURRENCY", max_concurrency)),
+        timeout=_env_float(f"{prefix}_TIMEOUT", timeout),
+        queue_timeout=_env_float(f"{prefix}_QUEUE_TIMEOUT", 0.25),
+        breaker=breaker,
+    )
@@ -0,0 +1,380 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import requests
+
+from upstream_guard import Deadline, DeadlineExceededError, ResponseCache, UpstreamBusyError, UpstreamGuard
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+AGRO_API_BASE = "https://api.agromonitoring.com/agro/1.0"
+USER_AGENT = "CropCure/1.0 (weather proxy)"
+REPORT_KINDS = ("weather", "soil", "forecast")
+
+
+class LocationNotFoundError(Exception):
+    """The geocoder has no match for the requested district and state."""
+
+
+class UpstreamHTTPError(Exception):
+    """
+    A weather/geocode HTTP call failed. The message names only the base URL,
+    never the query string, because that carries the AgroMonitoring key.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def normalize_location(state, district):
+    """Cache key for a lookup: 'district, state', lowercased with whitespace collapsed."""
+    clean = lambda value: " ".join(str(value).split()).lower()
+    return f"{clean(district)}, {clean(state)}"
+
+
+def tile_key(lat, lon, tile_degrees):
+    """Snap coordinates to the nearest point of a `tile_degrees` grid, so nearby lookups share a key."""
+    snap = lambda value: round(round(value / tile_degrees) * tile_degrees, 4)
+    return snap(lat), snap(lon)
+
+
+def http_get_json(url, params, timeout):
+    # requests' own messages include the full URL with params, so re-raise
+    # without them (and without chaining, so tracebacks don't carry them either)
+    try:
+        response = requests.get(url, params=params, headers={"User-Agent": USER_AGENT}, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        raise UpstreamHTTPError(f"HTTP {status} from {url}", status_code=status) from None
+    except requests.Timeout:
+        raise UpstreamHTTPError(f"Timed out calling {url}") from None
+    except requests.RequestException as e:
+        raise UpstreamHTTPError(f"{type(e).__name__} calling {url}") from None
+
+
+# --- Persistent geocode cache ---
+class GeocodeCache:
+    """
+    Maps normalized 'district, state' keys to {"lat", "lon"} and persists
+    them as a JSON file so lookups survive restarts.
+
+    Several worker processes (e.g. gunicorn workers) may share one file: a
+    write merges in the entries already on disk and atomically replaces the
+    file from a private temp file, and a miss re-reads the file if another
+    process changed it. Two writes racing between read and replace can still
+    drop one entry, which then simply gets geocoded again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._mtime = None
+        self._refresh()
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r") as f:
+                return dict(json.load(f))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Ignoring unreadable geocode cache {self.path}: {e}")
+            return {}
+
+    def _refresh(self):
+        """Merge in entries written to the file since we last saw it."""
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._entries = {**self._read_file(), **self._entries}
+            self._mtime = mtime
+
+    def get(self, key):
+        with self._lock:
+            coordinates = self._entries.get(key)
+            if coordinates is None:
+                self._refresh()
+                coordinates = self._entries.get(key)
+            return coordinates
+
+    def set(self, key, coordinates):
+        with self._lock:
+            self._entries[key] = coordinates
+            if not self.path:
+                return
+            self._entries = {**self._read_file(), **self._entries}
+            tmp_path = None
+            try:
+                with tempfile.NamedTemporaryFile(
+                    "w", dir=os.path.dirname(os.path.abspath(self.path)),
+                    prefix=".geocode_cache.", suffix=".tmp", delete=False,
+                ) as f:
+                    tmp_path = f.name
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+                self._mtime = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                print(f"Failed to persist geocode cache to {self.path}: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# --- Request coalescing ---
+class SingleFlight:
+    """
+    Concurrent calls for the same key share one execution of `fn` and its result.
+
+    The leader runs `fn(deadline)` with its own deadline. Followers wait only
+    as long as their own deadline allows, and if the leader failed because its
+    deadline ran out, they retry (one of them leading a new flight) instead of
+    inheriting that failure.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.deadline_expired = False
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn, deadline=None):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = self._Call()
+
+            if leader:
+                try:
+                    call.result = fn(deadline)
+                except Exception as e:
+                    call.error = e
+                    call.deadline_expired = deadline is not None and deadline.expired()
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+                if call.error is not None:
+                    raise call.error
+                return call.result
+
+            if not call.done.wait(deadline.remaining() if deadline else None):
+                raise DeadlineExceededError(self.name, "deadline passed waiting for a coalesced request")
+            if call.error is None:
+                return call.result
+            if not call.deadline_expired:
+                raise call.error
+
+
+# --- Weather/soil proxy ---
+class WeatherProxy:
+    """
+    Backend stand-in for the browser's Nominatim + AgroMonitoring calls.
+
+    Geocodes are cached persistently, unknown locations and upstream responses
+    (per lat/lon tile) are cached for `ttl` seconds, identical in-flight requests are coalesced and
+    the weather/soil/forecast calls for one report are fanned out in parallel.
+    The fan-out pool has one worker per AgroMonitoring slot by default, and a
+    report waits at most the guard's `queue_timeout` for a free worker.
+    """
+
+    def __init__(self, api_key, geocode_cache, geocode_guard=None, agro_guard=None,
+                 nominatim_url=NOMINATIM_URL, agro_api_base=AGRO_API_BASE,
+                 ttl=600.0, tile_degrees=0.05, max_workers=None, report_timeout=20.0,
+                 http_get=http_get_json):
+        self.api_key = api_key
+        self.geocode_cache = geocode_cache
+        self.geocode_guard = geocode_guard or UpstreamGuard("nominatim", max_concurrency=1)
+        self.agro_guard = agro_guard or UpstreamGuard("agromonitoring")
+        self.nominatim_url = nominatim_url
+        self.agro_api_base = agro_api_base.rstrip("/")
+        self.tile_degrees = tile_degrees
+        self.report_timeout = report_timeout
+        self.http_get = http_get
+
+        self.response_cache = ResponseCache(max_entries=4096, ttl=ttl)
+        self._geocode_flights = SingleFlight(self.geocode_guard.name)
+        self._fetch_flights = SingleFlight(self.agro_guard.name)
+        self.max_workers = max_workers or self.agro_guard.max_concurrency
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="weather-proxy")
+        self._pool_slots = threading.BoundedSemaphore(self.max_workers)
+        self._submitted = set()  # response keys queued on the pool, not yet finished
+        self._lock = threading.Lock()
+        self._metrics = {
+            "geocode_hits": 0,
+            "geocode_misses": 0,
+            "geocode_not_found_hits": 0,
+            "response_hits": 0,
+            "response_misses": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._metrics[key] += 1
+
+    def geocode(self, state, district, deadline=None):
+        key = normalize_location(state, district)
+        coordinates = self.geocode_cache.get(key)
+        if coordinates is not None:
+            self._count("geocode_hits")
+            return coordinates
+        not_found_key = ("geocode_not_found", key)
+        if self.response_cache.get(not_found_key) is not None:
+            self._count("geocode_not_found_hits")
+            raise LocationNotFoundError(f"Location not found: {district}, {state}")
+
+        def lookup(deadline):
+            # Another request may have filled the cache while we waited to lead.
+            cached = self.geocode_cache.get(key)
+            if cached is not None:
+                return cached
+            self._count("geocode_misses")
+            params = {"format": "json", "limit": 1, "q": f"{district}, {state}, India"}
+            results = self.geocode_guard.call(self.http_get, self.nominatim_url, params, deadline=deadline)
+            if not results:
+                self.response_cache.set(not_found_key, True)
+                raise LocationNotFoundError(f"Location not found: {district}, {state}")
+            found = {"lat": float(results[0]["lat"]), "lon": float(results[0]["lon"])}
+            self.geocode_cache.set(key, found)
+            return found
+
+        return self._geocode_flights.do(key, lookup, deadline)
+
+    def cached_response(self, kind, lat, lon):
+        """Return the cached `kind` response for the tile containing (lat, lon), or None."""
+        cached = self.response_cache.get((kind,) + tile_key(lat, lon, self.tile_degrees))
+        if cached is not None:
+            self._count("response_hits")
+        return cached
+
+    def fetch(self, kind, lat, lon, deadline=None):
+        """Return the AgroMonitoring `kind` response for the tile containing (lat, lon)."""
+        tile = tile_key(lat, lon, self.tile_degrees)
+        key = (kind,) + tile
+        cached = self.cached_response(kind, lat, lon)
+        if cached is not None:
+            return cached
+
+        def load(deadline):
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+            self._count("response_misses")
+            params = {"lat": tile[0], "lon": tile[1], "appid": self.api_key}
+            url = f"{self.agro_api_base}/{kind}"
+            data = self.agro_guard.call(self.http_get, url, params, deadline=deadline)
+            self.response_cache.set(key, data)
+            return data
+
+        return self._fetch_flights.do(key, load, deadline)
+
+    def report(self, state, district, kinds=REPORT_KINDS, deadline=None):
+        """
+        Geocode once, then fetch every `kind` in parallel within `deadline`
+        (`report_timeout` seconds if not given). Cache hits, and misses that
+        another request is already fetching, are served from the calling
+        thread; only new fetches go to the pool. Raises the first
+        failure and cancels fetches that have not started; running ones stop
+        at the deadline. Raises UpstreamBusyError if no pool worker frees up
+        within the AgroMonitoring guard's `queue_timeout`.
+        """
+        if deadline is None:
+            deadline = Deadline(self.report_timeout)
+        coordinates = self.geocode(state, district, deadline=deadline)
+        lat, lon = coordinates["lat"], coordinates["lon"]
+
+        tile = tile_key(lat, lon, self.tile_degrees)
+
+        report = {}
+        misses = []
+        joins = []
+        for kind in kinds:
+            cached = self.cached_response(kind, lat, lon)
+            if cached is not None:
+                report[kind] = cached
+                continue
+            key = (kind,) + tile
+            with self._lock:
+                if key in self._submitted or self._fetch_flights.in_flight(key):
+                    joins.append(kind)
+                else:
+                    self._submitted.add(key)
+                    misses.append(kind)
+
+        def finished(key):
+            with self._lock:
+                self._submitted.discard(key)
+            self._pool_slots.release()
+
+        futures = {}
+        try:
+            for index, kind in enumerate(misses):
+                key = (kind,) + tile
+                slot_timeout = min(self.agro_guard.queue_timeout, deadline.remaining())
+                try:
+                    if not self._pool_slots.acquire(timeout=slot_timeout):
+                        raise UpstreamBusyError(self.agro_guard.name, f"all {self.max_workers} fetch workers busy")
+                    try:
+                        future = self._pool.submit(self.fetch, kind, lat, lon, deadline)
+                    except Exception:
+                        self._pool_slots.release()
+                        raise
+                except Exception:
+                    with self._lock:
+                        self._submitted.difference_update((k,) + tile for k in misses[index:])
+                    raise
+                future.add_done_callback(lambda _, key=key: finished(key))
+                futures[kind] = future
+
+            # Coalesced fetches run elsewhere already, so wait for them here
+            for kind in joins:
+                report[kind] = self.fetch(kind, lat, lon, deadline)
+
+            done, pending = wait(futures.values(), timeout=deadline.remaining(), return_when=FIRST_EXCEPTION)
+            for future in futures.values():
+                if future in done and future.exception() is not None:
+                    raise future.exception()
+            if pending:
+                raise DeadlineExceededError(self.agro_guard.name, "report not ready before the deadline")
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+        report.update((kind, future.result()) for kind, future in futures.items())
+        report["location"] = {"state": state, "district": district, **coordinates}
+        return report
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {
+            "geocode_cache_entries": len(self.geocode_cache),
+            "response_cache_entries": len(self.response_cache),
+            "tile_degrees": self.tile_degrees,
+            "ttl_seconds": self.response_cache.ttl,
+            "metrics": metrics,
+        }
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { getCurrentWeather, getSoilData, getForecast } from '../services/weatherApi';
+import { getWeatherReport } from '../services/weatherApi';
 
 const WeatherPage = () => {
   const [selectedState, setSelectedState] = useState('');
@@ -50,16 +50,12 @@ const WeatherPage = () => {
     setError('');
 
     try {
-      // Use Promise.all to fetch all data in parallel
-      const [weatherResponse, soilResponse, forecastResponse] = await Promise.all([
-        getCurrentWeather(selectedState, selectedDistrict),
-        getSoilData(selectedState, selectedDistrict),
-        getForecast(selectedState, selectedDistrict)
-      ]);
-
-      setWeatherData(weatherResponse);
-      setSoilData(soilResponse);
-      setForecastData(forecastResponse);
+      // The backend fetches weather, soil and forecast data in parallel
+      const report = await getWeatherReport(selectedState, selectedDistrict);
+
+      setWeatherData(report.weather);
+      setSoilData(report.soil);
+      setForecastData(report.forecast);
       setApiConnected(true);
       
     } catch (err) {